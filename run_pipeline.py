@@ -1,7 +1,16 @@
 import argparse
+import contextlib
+import functools
+import importlib
+import io
+import os
+import re
+import shutil
 import subprocess
 import sys
+import time
 import csv
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -12,6 +21,16 @@ Exports results to CSV for convenience of viewing results, especially over multi
 
 root = Path(__file__).resolve().parent
 
+# Fixed per-run settings for --isolated subprocesses, built once instead of per call.
+# Unbuffered child stdout lets the compare verdicts stream back as they are printed.
+PYTHON = sys.executable
+ROOT_STR = str(root)
+ENV = {**os.environ, "PYTHONUNBUFFERED": "1"}
+
+# Stage modules live in src/ and import their siblings (schema_drift_config, ...) by name
+if str(root / "src") not in sys.path:
+    sys.path.insert(0, str(root / "src"))
+
 scripts = {
     "export": root / "src" / "01_export_patch.py",
     "mutate": root / "src" / "02_mutate_patch.py",
@@ -22,6 +41,30 @@ scripts = {
     "compare": root / "src" / "06_compare_original_vs_repaired.py",
 }
 
+# Verdict lines printed by the compare script, e.g. "  PASS: functions keyset EXACT MATCH"
+COMPARE_VERDICT = re.compile(r"(PASS|FAIL): (functions keyset|top-level patch keys)")
+VERDICT_FIELDS = {"functions keyset": "functions_keyset", "top-level patch keys": "top_level_keys"}
+
+# Parsed data/patch_reference.json, loaded once per pipeline run and shared by every trial
+REFERENCE_CACHE = None
+
+
+# (whole second, formatted timestamp) last returned by ts()
+_TS_CACHE = (-1, "")
+
+
+def ts() -> str:
+    """Local ISO-8601 timestamp at seconds precision, formatted at most once per wall-clock second."""
+    global _TS_CACHE
+    sec = int(time.time())
+    if sec != _TS_CACHE[0]:
+        _TS_CACHE = (sec, datetime.fromtimestamp(sec).isoformat(timespec="seconds"))
+    return _TS_CACHE[1]
+
+
+class StageError(RuntimeError):
+    """A pipeline stage failed (raised an exception in-process or exited non-zero)."""
+
 
 def run(script: Path, extra_args=None, capture=False):
     extra_args = extra_args or []
@@ -29,22 +72,165 @@ def run(script: Path, extra_args=None, capture=False):
         raise FileNotFoundError(f"Missing script: {script}")
 
     print(f"\n--- Running: {script.relative_to(root)} {' '.join(extra_args)} ---")
-    cmd = [sys.executable, str(script)] + extra_args
+    cmd = [PYTHON, str(script), *extra_args]
 
     if capture:
-        return subprocess.run(
-            cmd,
-            cwd=str(root),
-            check=True,
-            text=True,
-            capture_output=True,
-        )
+        res = subprocess.run(cmd, cwd=ROOT_STR, env=ENV, text=True, capture_output=True)
+    else:
+        res = subprocess.run(cmd, cwd=ROOT_STR, env=ENV)
+
+    if res.returncode:
+        raise StageError(f"{script.name} exited with status {res.returncode}")
+    return res if capture else None
+
+
+def run_stage(name: str, argv=None, quiet=False, isolated=False, **kwargs):
+    """
+    Run a pipeline stage. By default the stage module is imported once and its main()
+    is called in-process, so interpreter startup and numpy/torch imports are paid once
+    per pipeline run instead of once per stage per trial.
+
+    :param name: Key into `scripts`
+    :type name: str
+    :param argv: CLI arguments forwarded to the stage
+    :type argv: list[str] | None
+    :param quiet: Capture the stage's stdout instead of printing it
+    :type quiet: bool
+    :param isolated: Run the stage as a subprocess instead (see `run`)
+    :type isolated: bool
+    :param kwargs: Extra keyword arguments for the stage's main() (ignored when isolated)
+    :return: Result dict from the stage's main(), or the CompletedProcess when isolated
+    """
+    if isolated:
+        return run(scripts[name], argv, capture=quiet)
+
+    script = scripts[name]
+    print(f"\n--- Running: {script.relative_to(root)} {' '.join(argv or [])} ---")
+
+    module = importlib.import_module(script.stem)
+    if argv is not None:
+        kwargs["argv"] = argv
+    try:
+        if quiet:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return module.main(**kwargs)
+        return module.main(**kwargs)
+    except Exception as e:
+        raise StageError(f"Stage '{name}' failed: {type(e).__name__}: {e}") from e
+
+
+def parse_compare_output(lines) -> dict:
+    """Scan compare stdout lines for verdicts, stopping as soon as every check is found."""
+    verdicts = {}
+    for line in lines:
+        m = COMPARE_VERDICT.search(line)
+        if m:
+            verdicts[VERDICT_FIELDS[m.group(2)]] = m.group(1)
+            if len(verdicts) == len(VERDICT_FIELDS):
+                break
+    return verdicts
+
+
+def run_compare_isolated() -> dict:
+    """
+    Run the compare script as a subprocess and stream its stdout for the verdicts
+    instead of buffering the whole report.
+
+    :return: Verdicts keyed like the in-process compare result
+    :rtype: dict
+    :raises StageError: If compare exits non-zero before reporting both checks
+    """
+    script = scripts["compare"]
+    print(f"\n--- Running: {script.relative_to(root)}  ---")
+
+    with subprocess.Popen([PYTHON, str(script)], cwd=ROOT_STR, env=ENV,
+                          stdout=subprocess.PIPE, text=True) as proc:
+        verdicts = parse_compare_output(proc.stdout)
+        if len(verdicts) == len(VERDICT_FIELDS):
+            # Only the sample field report is left, which is not recorded
+            proc.terminate()
+            return verdicts
+
+    if proc.returncode:
+        raise StageError(f"{script.name} exited with status {proc.returncode}")
+    return verdicts
+
+
+def init_worker(reference: dict):
+    """ProcessPoolExecutor initializer: share the parsed reference and match the parent's cwd."""
+    global REFERENCE_CACHE
+    REFERENCE_CACHE = reference
+    os.chdir(root)
+
+
+def run_trial(t: int, args) -> dict:
+    """
+    Run one mutate -> (LLM) -> repair -> (to_pkl) -> compare trial. Serial runs work in
+    data/ directly; parallel runs give each trial its own data/trial_<t>/ directory.
+
+    :param t: Trial index, also used as the mutation seed
+    :type t: int
+    :param args: Parsed run_pipeline arguments
+    :type args: argparse.Namespace
+    :return: Trial id and the two compare verdicts
+    :rtype: dict
+    """
+    print(f"\n===== TRIAL {t + 1} / {args.trials} =====")
+
+    trial_dir = "data" if args.jobs == 1 else os.path.join("data", f"trial_{t}")
+    os.makedirs(trial_dir, exist_ok=True)
+
+    # Build mutation args
+    mutate_args = [
+        "--seed", str(t),
+        "--trial-id", str(t),
+    ]
+
+    if args.mutate_mode:
+        mutate_args += ["--mode", args.mutate_mode]
+    if args.order:
+        mutate_args += ["--order", args.order]
 
-    subprocess.run(cmd, cwd=str(root), check=True)
-    return None
+    mutated = run_stage("mutate", mutate_args, isolated=args.isolated,
+                        obj=REFERENCE_CACHE, trial_dir=trial_dir)
+
+    if not args.skip_llm:
+        run_stage("llm", isolated=args.isolated, trial_dir=trial_dir)
+    elif trial_dir != "data":
+        # Without the LLM stage, every trial reuses the existing data/repair_plan.json (as a serial
+        # run does); parallel trials need their own copy next to their patches
+        shutil.copyfile(os.path.join("data", "repair_plan.json"), os.path.join(trial_dir, "repair_plan.json"))
+
+    repaired = run_stage("repair", isolated=args.isolated, trial_dir=trial_dir)
+
+    # Fast format already handed the patches off as pickles, so there is nothing to convert.
+    # Otherwise hand 04 the objects still in memory rather than re-parsing their JSON.
+    if not args.fast_format:
+        if args.isolated:
+            run_stage("to_pkl", isolated=True)
+        else:
+            run_stage("to_pkl", mutated=mutated["obj"], repaired=repaired["obj"], trial_dir=trial_dir)
+    if args.trials == 1:
+        run_stage("break_demo", isolated=args.isolated, trial_dir=trial_dir,
+                  original_patch=REFERENCE_CACHE["patch"])  # Tons of terminal bloat. If multiple runs, just skip.
+
+    # Defaults in case compare is skipped
+    result = {"trial_id": t, "functions_keyset": "SKIPPED", "top_level_keys": "SKIPPED"}
+
+    if not args.skip_compare:
+        if args.isolated:
+            verdicts = run_compare_isolated()
+        else:
+            verdicts = run_stage("compare", quiet=True, trial_dir=trial_dir,
+                                 original_patch=REFERENCE_CACHE["patch"])
+        result.update(verdicts)
+
+    return result
 
 
 def main():
+    global REFERENCE_CACHE
+
     ap = argparse.ArgumentParser(
         description="Run the ZEN schema-drift + LLM repair pipeline."
     )
@@ -63,12 +249,43 @@ def main():
                     choices=["rename_then_wrap", "wrap_then_rename", "random"],
                     default=None,
                     help="Forward --order to 02_mutate_patch.py.")
+    ap.add_argument("--isolated", action="store_true",
+                    help="Run every stage in its own Python process (slower).")
+    ap.add_argument("--fast-format", action="store_true",
+                    help="Hand mutated/repaired patches between stages as pickles (sets FAST_FORMAT=1).")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Trials to run in parallel worker processes (default: 1; 0 = one per CPU). "
+                         "Parallel trials write to data/trial_<t>/.")
+    ap.add_argument("--plan-cache", metavar="PATH", default=None,
+                    help="Reuse LLM plans for identical excerpts, persisted to PATH (sets PLAN_CACHE). "
+                         "Off by default so every trial is an independent LLM call.")
 
     args = ap.parse_args()
 
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    if args.jobs < 0:
+        ap.error("--jobs must be >= 0")
+    if args.isolated and args.jobs != 1:
+        ap.error("--isolated runs stages against data/ directly and cannot be combined with --jobs")
+
+    # Must be set before the stage modules (and patch_io) are first imported
+    if args.fast_format:
+        os.environ["FAST_FORMAT"] = ENV["FAST_FORMAT"] = "1"
+    if args.plan_cache:
+        os.environ["PLAN_CACHE"] = ENV["PLAN_CACHE"] = os.path.abspath(args.plan_cache)
+
+    # Stages resolve data/ relative to the working directory
+    os.chdir(root)
+
     # Export once
     if not args.skip_export:
-        run(scripts["export"])
+        run_stage("export", isolated=args.isolated)
+
+    # Parse the immutable reference once; trials get a deep copy instead of re-reading it.
+    # patch_io is imported only now because it reads FAST_FORMAT at import time.
+    from patch_io import load_json
+    REFERENCE_CACHE = load_json(root / "data" / "patch_reference.json")
 
     # Prepare results CSV (trimmed columns + running accuracy)
     results_path = root / "data" / "trial_results.csv"
@@ -84,7 +301,8 @@ def main():
     ]
 
     new_file = not results_path.exists()
-    csv_f = open(results_path, "a", newline="", encoding="utf-8")
+    # Line-buffered: every row reaches the file as soon as it is written
+    csv_f = open(results_path, "a", newline="", encoding="utf-8", buffering=1)
     writer = csv.DictWriter(csv_f, fieldnames=fieldnames)
 
     if new_file:
@@ -93,70 +311,52 @@ def main():
     trials = args.trials
     success_count = 0
 
-    for t in range(trials):
-        print(f"\n===== TRIAL {t + 1} / {trials} =====")
-
-        # Build mutation args
-        mutate_args = [
-            "--seed", str(t),
-            "--trial-id", str(t),
-        ]
-
-        if args.mutate_mode:
-            mutate_args += ["--mode", args.mutate_mode]
-        if args.order:
-            mutate_args += ["--order", args.order]
-
-        run(scripts["mutate"], mutate_args)
-
-        if not args.skip_llm:
-            run(scripts["llm"])
-
-        run(scripts["repair"])
-        run(scripts["to_pkl"])
-        if trials == 1:
-            run(scripts["break_demo"])  # Tons of terminal bloat. If multiple runs, just skip.
-
-        # Defaults in case compare is skipped
-        functions_keyset = "SKIPPED"
-        top_level_keys = "SKIPPED"
-
-        if not args.skip_compare:
-            res = run(scripts["compare"], capture=True)
-            out = res.stdout or ""
-
-            if "PASS: functions keyset EXACT MATCH" in out:
-                functions_keyset = "PASS"
-            elif "FAIL: functions keyset DIFFER" in out:
-                functions_keyset = "FAIL"
-
-            if "PASS: top-level patch keys match" in out:
-                top_level_keys = "PASS"
-            elif "FAIL: top-level patch keys differ" in out:
-                top_level_keys = "FAIL"
-
-        print("\n[FUNCTIONS KEYSET CHECK]")
-        print(f"  {functions_keyset}: functions keyset")
-        print("\n[TOP-LEVEL PATCH KEYS CHECK]")
-        print(f"  {top_level_keys}: top-level patch keys")
-
-        # Running accuracy. Count a success only if both checks pass
-        trial_passed = (functions_keyset == "PASS") and (top_level_keys == "PASS")
-        if trial_passed:
-            success_count += 1
-        accuracy = f"{success_count}/{t + 1}"
-
-        writer.writerow({
-            #"timestamp": datetime.now().isoformat(timespec="seconds"),
-            "trial_id": t,
-            "mode": args.mutate_mode or "default",
-            "functions_keyset": functions_keyset,
-            "top_level_keys": top_level_keys,
-            "accuracy": accuracy,
-        })
-        csv_f.flush()
-
-    csv_f.close()
+    # Trials are independent (explicit per-trial seeds), so they can be fanned out to workers.
+    # Results come back in trial order either way, keeping the running accuracy meaningful.
+    trial = functools.partial(run_trial, args=args)
+    pool = None
+    if args.jobs != 1:
+        pool = ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                                   initargs=(REFERENCE_CACHE,))
+
+    # Serial runs put each finished trial on disk right away, so a killed run keeps its rows.
+    # Parallel rows are collected and written in one go; the finally keeps finished trials on errors.
+    rows = []
+    try:
+        with pool or contextlib.nullcontext():
+            results = pool.map(trial, range(trials)) if pool else map(trial, range(trials))
+
+            for t, result in enumerate(results):
+                functions_keyset = result["functions_keyset"]
+                top_level_keys = result["top_level_keys"]
+
+                print("\n[FUNCTIONS KEYSET CHECK]")
+                print(f"  {functions_keyset}: functions keyset")
+                print("\n[TOP-LEVEL PATCH KEYS CHECK]")
+                print(f"  {top_level_keys}: top-level patch keys")
+
+                # Running accuracy. Count a success only if both checks pass
+                trial_passed = (functions_keyset == "PASS") and (top_level_keys == "PASS")
+                if trial_passed:
+                    success_count += 1
+                accuracy = f"{success_count}/{t + 1}"
+
+                row = {
+                    #"timestamp": ts(),
+                    "trial_id": t,
+                    "mode": args.mutate_mode or "default",
+                    "functions_keyset": functions_keyset,
+                    "top_level_keys": top_level_keys,
+                    "accuracy": accuracy,
+                }
+                if pool:
+                    rows.append(row)
+                else:
+                    writer.writerow(row)
+    finally:
+        writer.writerows(rows)
+        csv_f.close()
+
     print(f"\nWrote trial summary: {results_path}")
     print("Pipeline completed successfully.")
 
@@ -1,20 +1,152 @@
-import json
 import os
 import pickle
+import reprlib
+import sys
+from array import array
+from collections import deque
 from datetime import datetime
 from typing import Any
 
-import numpy as np
-import torch
+from patch_io import dump_json
 
 # File paths for the pikl files and the final output
 INPUT_PKL = os.path.join("data", "patch_original.pkl")
 OUTPUT_JSON = os.path.join("data", "patch_reference.json")
 
 
+# Exact types that are already JSON-serializable and returned as-is
+SCALAR_TYPES = (type(None), bool, int, float)
+
+# Builtin containers to_jsonable does not map to JSON are rendered with reprlib, which stops
+# after 20 items instead of building the full repr first. Other objects still run their own
+# __repr__ in full; only the result is cut to 2000 characters.
+_CONTAINER_REPR_TYPES = (frozenset, deque, array)
+_REPR = reprlib.Repr()
+_REPR.maxstring = _REPR.maxother = 2000
+_REPR.maxlist = _REPR.maxtuple = _REPR.maxdict = 20
+_REPR.maxset = _REPR.maxfrozenset = _REPR.maxdeque = _REPR.maxarray = 20
+
+
+def _scalar(obj: Any, max_str_len: int, stack: list) -> Any:
+    return obj
+
+
+def _string(obj: str, max_str_len: int, stack: list) -> str:
+    if len(obj) > max_str_len:
+        return obj[:max_str_len] + "...(truncated)"
+    return obj
+
+
+def _bytes_stub(obj: Any, max_str_len: int, stack: list) -> dict:
+    # Store the size and preview
+    return {
+        "__type__": "bytes",
+        "len": len(obj),
+        "preview_hex": memoryview(obj)[:64].hex(),
+    }
+
+
+def _dict_container(obj: dict, max_str_len: int, stack: list) -> dict:
+    # Dicts with string keys, emitted in sorted key order so the JSON writer need not sort.
+    # Leaves are stored directly; anything else gets its slot reserved and is pushed.
+    out = {}
+    children = []
+    for k in sorted(obj, key=str):
+        v = obj[k]
+        k = str(k)
+        if k in out:
+            # Later duplicate of a stringified key wins, as in a dict comprehension
+            children = [c for c in children if c[1] != k]
+        t = type(v)
+        if t in SCALAR_TYPES or (t is str and len(v) <= max_str_len):
+            out[k] = v
+        else:
+            out[k] = None
+            children.append((out, k, v))
+    stack.extend(children)
+    return out
+
+
+def _list_container(obj: Any, max_str_len: int, stack: list) -> list:
+    out = list(obj)
+    for i, x in enumerate(out):
+        t = type(x)
+        if not (t in SCALAR_TYPES or (t is str and len(x) <= max_str_len)):
+            stack.append((out, i, x))
+    return out
+
+
+def _ndarray_stub(obj: Any, max_str_len: int, stack: list) -> dict:
+    return {
+        "__type__": "ndarray",
+        "dtype": str(obj.dtype),
+        "shape": list(obj.shape),
+    }
+
+
+def _tensor_stub(obj: Any, max_str_len: int, stack: list) -> dict:
+    # Keys in sorted order, like every dict to_jsonable emits
+    return {
+        "__type__": "torch.Tensor",
+        "device": str(obj.device),
+        "dtype": str(obj.dtype),
+        "shape": list(obj.shape),
+    }
+
+
+def _repr_stub(obj: Any, max_str_len: int, stack: list) -> dict:
+    # Unknown objects of other types
+    if type(obj) in _CONTAINER_REPR_TYPES:
+        return {"__type__": type(obj).__name__, "repr": _REPR.repr(obj)}
+    r = repr(obj)
+    if len(r) > 2000:
+        r = r[:2000] + "...(truncated)"
+    return {"__type__": type(obj).__name__, "repr": r}
+
+
+# Exact type -> handler. Subclasses and ndarray/Tensor miss here, get resolved by
+# _resolve_handler and cached.
+_DISPATCH = {
+    **{t: _scalar for t in SCALAR_TYPES},
+    str: _string,
+    bytes: _bytes_stub,
+    bytearray: _bytes_stub,
+    dict: _dict_container,
+    list: _list_container,
+    tuple: _list_container,
+    set: _list_container,
+}
+
+
+def _resolve_handler(obj: Any):
+    """isinstance-based lookup (same precedence as the exact-type table) for subclasses."""
+    if isinstance(obj, str):
+        return _string
+    if isinstance(obj, (bool, int, float)):
+        return _scalar
+    if isinstance(obj, (bytes, bytearray)):
+        return _bytes_stub
+    if isinstance(obj, dict):
+        return _dict_container
+    if isinstance(obj, (list, tuple, set)):
+        return _list_container
+
+    # numpy/torch are not imported here: unpickling an ndarray/Tensor already imported them,
+    # so if they are absent from sys.modules the patch cannot contain any.
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(obj, np.ndarray):
+        return _ndarray_stub
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(obj, torch.Tensor):
+        return _tensor_stub
+    return _repr_stub
+
+
 def to_jsonable(obj: Any, max_str_len: int = 5000) -> Any:
     """
     Converts a Python object into something that can be serialized as a JSON.
+    Walks the object with an explicit worklist rather than recursion, so deeply
+    nested patches cannot hit the recursion limit.
     
     :param obj: Object to convert
     :type obj: Any
@@ -23,52 +155,29 @@ def to_jsonable(obj: Any, max_str_len: int = 5000) -> Any:
     :return: JSON-serializable representation of obj
     :rtype: Any
     """
-    # Already JSON-serializable
-    if obj is None or isinstance(obj, (bool, int, float, str)):
-        if isinstance(obj, str) and len(obj) > max_str_len:
-            return obj[:max_str_len] + "...(truncated)"
-        return obj
+    result = [None]
+    # (parent container, key/index in parent, object to convert)
+    stack = [(result, 0, obj)]
 
-    # Store the size and preview
-    if isinstance(obj, (bytes, bytearray)):
-        return {
-            "__type__": "bytes",
-            "len": len(obj),
-            "preview_hex": bytes(obj[:64]).hex(),
-        }
+    while stack:
+        parent, key, cur = stack.pop()
+        t = type(cur)
+        handler = _DISPATCH.get(t)
+        if handler is None:
+            handler = _DISPATCH[t] = _resolve_handler(cur)
+        # Containers return their (empty) output and push their children onto the stack
+        parent[key] = handler(cur, max_str_len, stack)
 
-    # Dicts with string keys
-    if isinstance(obj, dict):
-        return {str(k): to_jsonable(v, max_str_len=max_str_len) for k, v in obj.items()}
-
-    if isinstance(obj, (list, tuple, set)):
-        return [to_jsonable(x, max_str_len=max_str_len) for x in obj]
-
-    # Numpy Arrays
-    if isinstance(obj, np.ndarray):
-        return {
-            "__type__": "ndarray",
-            "dtype": str(obj.dtype),
-            "shape": list(obj.shape),
-        }
-
-    # Torch Tensors
-    if isinstance(obj, torch.Tensor):
-        return {
-            "__type__": "torch.Tensor",
-            "dtype": str(obj.dtype),
-            "shape": list(obj.shape),
-            "device": str(obj.device),
-        }
+    return result[0]
 
-    # Unknown objects of other types
-    r = repr(obj)
-    if len(r) > 2000:
-        r = r[:2000] + "...(truncated)"
-    return {"__type__": type(obj).__name__, "repr": r}
 
+def main() -> dict:
+    """
+    Export the canonical patch pickle to JSON.
 
-def main():
+    :return: Output path and the patch's top-level keys
+    :rtype: dict
+    """
     if not os.path.exists(INPUT_PKL):
         raise FileNotFoundError(f"Missing input pickle: {INPUT_PKL}")
 
@@ -78,6 +187,7 @@ def main():
     # Patch type for debugging
     print("Patch type:", type(patch))
 
+    keys = []
     if hasattr(patch, "keys"):
         keys = list(patch.keys())
         print("Top-level keys:")
@@ -98,16 +208,11 @@ def main():
 
     # Write the JSON to the disk
     os.makedirs(os.path.dirname(OUTPUT_JSON), exist_ok=True)
-    with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-        json.dump(
-            export,
-            f,
-            indent=2,
-            ensure_ascii=False,
-            sort_keys=True,
-        )
+    # to_jsonable already emits sorted keys, and the wrapper keys are written in order
+    dump_json(export, OUTPUT_JSON)
 
     print(f"\nExported to {OUTPUT_JSON}")
+    return {"output": OUTPUT_JSON, "top_level_keys": keys}
 
 
 if __name__ == "__main__":
@@ -1,18 +1,39 @@
+import copy
 import json
 import os
 import argparse
 import random
 from datetime import datetime
 
-from schema_drift_config import CANON_KEY, RENAME_VARIANTS, WRAPPER_VARIANTS, EXTRA_STRUCT_KEYS
-
-# File paths for the incoming, outgoing, JSON patches and the outgoing log
-IN_JSON = os.path.join("data", "patch_reference.json")
-OUT_JSON = os.path.join("data", "patch_mutated.json")
-OUT_LOG = os.path.join("data", "mutation_log.json")
-
-
-def main():
+from patch_io import DATA_DIR, dump_json, handoff_path, load_json, save_patch_file
+from schema_drift_config import (
+    CANON_KEY,
+    RENAME_VARIANTS,
+    RENAME_VARIANTS_SET,
+    WRAPPER_VARIANTS,
+    EXTRA_STRUCT_KEYS,
+    find_functions_key,
+)
+
+# File path for the incoming reference patch; the mutated patch and log are written to trial_dir
+IN_JSON = os.path.join(DATA_DIR, "patch_reference.json")
+OUT_PATCH = "patch_mutated"
+OUT_LOG = "mutation_log.json"
+
+
+def main(argv=None, obj=None, trial_dir: str = DATA_DIR) -> dict:
+    """
+    Apply schema drift to the reference patch and write the mutated patch + log.
+
+    :param argv: CLI arguments to parse instead of sys.argv (used by run_pipeline)
+    :type argv: list[str] | None
+    :param obj: Already-parsed patch_reference.json; deep-copied instead of re-reading the file
+    :type obj: dict | None
+    :param trial_dir: Directory the mutated patch and mutation log are written to
+    :type trial_dir: str
+    :return: Output path, the mutation log and the mutated (JSON-wrapped) patch object
+    :rtype: dict
+    """
     # Parse the CLI arguments for the drifts to mutate the patch
     parser = argparse.ArgumentParser(
         description="Apply controlled schema drift to ZEN patch dictionary"
@@ -39,14 +60,16 @@ def main():
         help="Order of operations when both rename and wrapper are applied.",
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    # Assign Seeds for Later Reproducability
-    if args.seed is not None:
-        random.seed(args.seed)
+    # Per-call generator (seeded for later reproducability) so in-process or parallel
+    # trials never share the global random state
+    rng = random.Random(args.seed)
 
-    with open(IN_JSON, "r", encoding="utf-8") as f:
-        obj = json.load(f)
+    if obj is not None:
+        obj = copy.deepcopy(obj)
+    else:
+        obj = load_json(IN_JSON)
 
     # Note: we mutate obj["patch"] in-place so the __meta__ wrapper is preserved.
     patch = obj["patch"]
@@ -57,9 +80,9 @@ def main():
 
     # Options for possible drifts for mutation
     if args.mode == "random":
-        use_rename = random.choice([True, False])
-        use_wrap = random.choice([True, False])
-        use_extra = random.choice([True, False])
+        use_rename = rng.choice([True, False])
+        use_wrap = rng.choice([True, False])
+        use_extra = rng.choice([True, False])
 
         # Ensure at least one drift happens
         if not (use_rename or use_wrap or use_extra):
@@ -72,20 +95,23 @@ def main():
     # Select parameters for each drift option
     if use_rename:
         # Choose a rename target that doesn't already exist as a top-level key.
-        candidates = [k for k in RENAME_VARIANTS if k not in patch]
+        # The set intersection runs in C; candidates keep RENAME_VARIANTS order so a given
+        # seed always picks the same target.
+        taken = patch.keys() & RENAME_VARIANTS_SET
+        candidates = [k for k in RENAME_VARIANTS if k not in taken] if taken else RENAME_VARIANTS
         if not candidates:
             raise RuntimeError("No available rename targets")
-        rename_to = random.choice(candidates)
+        rename_to = rng.choice(candidates)
     else:
         rename_to = None
 
-    wrapper_key = random.choice(WRAPPER_VARIANTS) if use_wrap else None
-    extra_key = random.choice(EXTRA_STRUCT_KEYS) if use_extra else None
+    wrapper_key = rng.choice(WRAPPER_VARIANTS) if use_wrap else None
+    extra_key = rng.choice(EXTRA_STRUCT_KEYS) if use_extra else None
 
     # Determine operation order only when both rename and wrap are used
     if use_rename and use_wrap:
         if args.order == "random":
-            op_order = random.choice(["rename_then_wrap", "wrap_then_rename"])
+            op_order = rng.choice(["rename_then_wrap", "wrap_then_rename"])
         else:
             op_order = args.order
     else:
@@ -113,11 +139,9 @@ def main():
         Returns the key name that currently holds the functions container.
         (Either the canonical key or one of the rename variants.)
         """
-        if CANON_KEY in p:
-            return CANON_KEY
-        for k in RENAME_VARIANTS:
-            if k in p:
-                return k
+        key = find_functions_key(p)
+        if key is not None:
+            return key
         raise KeyError("Could not locate functions dict under canonical or known renamed keys.")
 
     if not isinstance(patch[CANON_KEY], dict):
@@ -162,8 +186,8 @@ def main():
         raise RuntimeError("No mutation applied.")
 
     # Write patch and mutation log
-    with open(OUT_JSON, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2, ensure_ascii=False)
+    out_patch = handoff_path(OUT_PATCH, trial_dir)
+    save_patch_file(obj, out_patch)
 
     mutation_log = {
         "trial_id": args.trial_id,
@@ -178,11 +202,11 @@ def main():
         "order": op_order,
     }
 
-    with open(OUT_LOG, "w", encoding="utf-8") as f:
-        json.dump(mutation_log, f, indent=2, ensure_ascii=False)
+    dump_json(mutation_log, os.path.join(trial_dir, OUT_LOG))
 
     print("Mutation complete.")
     print(json.dumps(mutation_log, indent=2))
+    return {"output": out_patch, "mutation_log": mutation_log, "obj": obj}
 
 
 if __name__ == "__main__":
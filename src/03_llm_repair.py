@@ -1,29 +1,48 @@
-import json
 import os
 
+from patch_io import DATA_DIR, dump_json, handoff_path, load_patch_file
 from schema_repair_patcher import SchemaRepairPatcher
 
-IN_JSON = os.path.join("data", "patch_mutated.json")
-OUT_PLAN = os.path.join("data", "repair_plan.json")
+# Files read/written inside the trial directory
+IN_PATCH = "patch_mutated"
+OUT_PLAN = "repair_plan.json"
 
+# Max plans kept when the plan cache is enabled (PLAN_CACHE=<path>)
+PLAN_CACHE_SIZE = 128
 
-def main():
+# Shared across in-process calls (one per trial) so the Gemini client is only built once
+ENGINE = None
+
+
+def get_engine() -> SchemaRepairPatcher:
+    """
+    Return the module's SchemaRepairPatcher, creating it on first use. Setting PLAN_CACHE to a
+    file path reuses plans for identical excerpts (persisted there) instead of asking the LLM again.
+    """
+    global ENGINE
+    if ENGINE is None:
+        plan_cache = os.environ.get("PLAN_CACHE") or None
+        ENGINE = SchemaRepairPatcher(plan_cache_size=PLAN_CACHE_SIZE if plan_cache else 0,
+                                     plan_cache_path=plan_cache)
+    return ENGINE
+
+
+def main(trial_dir: str = DATA_DIR) -> dict:
     # Infer a schema repair plan from LLM
-    with open(IN_JSON, "r", encoding="utf-8") as f:
-        obj = json.load(f)
+    obj = load_patch_file(handoff_path(IN_PATCH, trial_dir))
 
     patch = obj["patch"]
 
-    engine = SchemaRepairPatcher()
-    plan = engine.infer_plan_from_patch(patch)
+    plan = get_engine().infer_plan_from_patch(patch)
 
-    with open(OUT_PLAN, "w", encoding="utf-8") as f:
-        json.dump(plan, f, indent=2, ensure_ascii=False)
+    out_plan = os.path.join(trial_dir, OUT_PLAN)
+    dump_json(plan, out_plan)
 
-    print(f"Wrote: {OUT_PLAN}")
+    print(f"Wrote: {out_plan}")
     print("Inferred actions:")
     for a in plan.get("actions", []):
         print(" ", a)
+    return plan
 
 
 if __name__ == "__main__":
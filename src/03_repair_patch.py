@@ -1,33 +1,41 @@
-import json
 import os
+import shutil
 
+from patch_io import DATA_DIR, handoff_path, load_json, load_patch_file, save_patch_file
 from schema_repair_patcher import SchemaRepairPatcher
 
-IN_JSON = os.path.join("data", "patch_mutated.json")
-IN_PLAN = os.path.join("data", "repair_plan.json")
-OUT_JSON = os.path.join("data", "patch_repaired.json")
+# Files read/written inside the trial directory
+IN_PATCH = "patch_mutated"
+IN_PLAN = "repair_plan.json"
+OUT_PATCH = "patch_repaired"
 
 
-def main():
+def main(trial_dir: str = DATA_DIR) -> dict:
     # Apply deterministic fixes to the mutated patch from the plan given by the LLM
-    with open(IN_JSON, "r", encoding="utf-8") as f:
-        obj = json.load(f)
+    in_patch = handoff_path(IN_PATCH, trial_dir)
+    out_patch = handoff_path(OUT_PATCH, trial_dir)
 
-    with open(IN_PLAN, "r", encoding="utf-8") as f:
-        plan = json.load(f)
+    plan = load_json(os.path.join(trial_dir, IN_PLAN))
+
+    # Nothing to apply: the repaired patch is byte-for-byte the mutated one
+    if plan.get("actions", []) == []:
+        shutil.copyfile(in_patch, out_patch)
+        print(f"Wrote: {out_patch} (no actions; copied through)")
+        return {"output": out_patch, "logs": [], "obj": None}
 
+    obj = load_patch_file(in_patch)
     patch = obj["patch"]
 
     engine = SchemaRepairPatcher()
     logs = engine.apply_plan_to_patch(patch, plan)
 
-    with open(OUT_JSON, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2, ensure_ascii=False)
+    save_patch_file(obj, out_patch)
 
-    print(f"Wrote: {OUT_JSON}")
+    print(f"Wrote: {out_patch}")
     print("Applied actions:")
     for line in logs:
         print(" ", line)
+    return {"output": out_patch, "logs": logs, "obj": obj}
 
 
 if __name__ == "__main__":
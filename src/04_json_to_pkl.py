@@ -1,9 +1,13 @@
-import json
 import os
-import pickle
+from typing import Optional
 
+from patch_io import DATA_DIR, FAST_FORMAT, dump_pickle, load_json, load_pickle
 
-def convert(json_path: str, pkl_path: str):
+# Patch files (without extension) converted from .json to .pkl inside the trial directory
+CONVERSIONS = ["patch_mutated", "patch_repaired"]
+
+
+def convert(json_path: str, pkl_path: str, obj: Optional[dict] = None):
     """
     Convert a JSON-wrapped patch into a pickle file containing only the underlying patch dictionary
 
@@ -11,25 +15,43 @@ def convert(json_path: str, pkl_path: str):
     :type json_path: str
     :param pkl_path: Destination path for output pickle
     :type pkl_path: str
+    :param obj: Already-loaded JSON-wrapped patch; json_path is not read when given
+    :type obj: Optional[dict]
     """
-    with open(json_path, "r", encoding="utf-8") as f:
-        obj = json.load(f)
+    if obj is None:
+        obj = load_json(json_path)
 
     patch = obj["patch"]
-    with open(pkl_path, "wb") as f:
-        pickle.dump(patch, f, protocol=pickle.HIGHEST_PROTOCOL)
+    dump_pickle(patch, pkl_path)
 
     print(f"Wrote: {pkl_path}")
 
 
-def main():
-    convert(os.path.join("data", "patch_mutated.json"), os.path.join("data", "patch_mutated.pkl"))
-    convert(os.path.join("data", "patch_repaired.json"), os.path.join("data", "patch_repaired.pkl"))
+def main(mutated: Optional[dict] = None, repaired: Optional[dict] = None, trial_dir: str = DATA_DIR) -> dict:
+    """
+    Convert the mutated and repaired patches to pickles and sanity-load them.
+
+    :param mutated: In-memory mutated patch object (skips re-reading its JSON)
+    :type mutated: Optional[dict]
+    :param repaired: In-memory repaired patch object (skips re-reading its JSON)
+    :type repaired: Optional[dict]
+    :param trial_dir: Directory holding the patch files
+    :type trial_dir: str
+    :return: Paths of the pickles that were checked
+    :rtype: dict
+    """
+    if FAST_FORMAT:
+        # Stages already handed the patches off as pickles; nothing to convert
+        print("FAST_FORMAT set: patches already pickled, skipping conversion")
+    else:
+        for stem, obj in zip(CONVERSIONS, (mutated, repaired)):
+            base = os.path.join(trial_dir, stem)
+            convert(base + ".json", base + ".pkl", obj=obj)
 
     # Sanity-load
-    for p in ["data/patch_mutated.pkl", "data/patch_repaired.pkl"]:
-        with open(p, "rb") as f:
-            obj = pickle.load(f)
+    written = [os.path.join(trial_dir, stem + ".pkl") for stem in CONVERSIONS]
+    for p in written:
+        obj = load_pickle(p)
         print("\nLoaded:", p)
         print("  type:", type(obj))
         print("  has keys:", hasattr(obj, "keys"))
@@ -40,6 +62,7 @@ def main():
                 print("  functions type:", type(fn))
                 if isinstance(fn, dict):
                     print("  functions keys (first 10):", list(fn.keys())[:10])
+    return {"written": written}
 
 if __name__ == "__main__":
     main()
@@ -1,31 +1,45 @@
-import json
 import os
+from typing import Optional
+
+from patch_io import DATA_DIR, handoff_path, load_patch_file
 from schema_drift_config import CANON_KEY, find_functions_key
 
-# File paths
-ORIGINAL_PATCH_PATH = os.path.join("data", "patch_reference.json")
-MUTATED_PATCH_PATH = os.path.join("data", "patch_mutated.json")
-REPAIRED_PATCH_PATH = os.path.join("data", "patch_repaired.json")
-MUTATION_LOG_PATH = os.path.join("data", "mutation_log.json")
+# File paths. The reference lives in data/; the rest are looked up in the trial directory.
+ORIGINAL_PATCH_PATH = os.path.join(DATA_DIR, "patch_reference.json")
+MUTATED_PATCH_PATH = "patch_mutated"
+REPAIRED_PATCH_PATH = "patch_repaired"
+MUTATION_LOG_PATH = "mutation_log.json"
 
 
 def load_patch(path: str) -> dict:
     """
-    Load a JSON-wrapped patch file and return underlying patch dict.
+    Load a JSON-wrapped (or pickled) patch file and return underlying patch dict.
     
-    :param path: Path to JSON file
+    :param path: Path to JSON or pickle file
     :type path: str
     :return: Extracted patch dictionary
     :rtype: dict
     """
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)["patch"]
+    return load_patch_file(path)["patch"]
 
 
-def main():
-    original_patch = load_patch(ORIGINAL_PATCH_PATH)
-    mutated_patch = load_patch(MUTATED_PATCH_PATH)
-    repaired_patch = load_patch(REPAIRED_PATCH_PATH)
+def main(original_patch: Optional[dict] = None, trial_dir: str = DATA_DIR) -> dict:
+    """
+    Show canonical access failing on the mutated patch and succeeding after repair.
+
+    :param original_patch: Already-loaded reference patch; read from disk if not given
+    :type original_patch: Optional[dict]
+    :param trial_dir: Directory holding the mutated/repaired patches
+    :type trial_dir: str
+    :return: Whether canonical access succeeded on each patch
+    :rtype: dict
+    """
+    status = {"original": False, "mutated": False, "repaired": False}
+
+    if original_patch is None:
+        original_patch = load_patch(ORIGINAL_PATCH_PATH)
+    mutated_patch = load_patch(handoff_path(MUTATED_PATCH_PATH, trial_dir))
+    repaired_patch = load_patch(handoff_path(REPAIRED_PATCH_PATH, trial_dir))
 
     # Select a representative function key 
     try:
@@ -36,6 +50,7 @@ def main():
     print("\n[ORIGINAL]")
     try:
         _ = original_patch[CANON_KEY][target_fn]
+        status["original"] = True
         print(f"OK: patch['{CANON_KEY}']['{target_fn}'] exists")
     except Exception as e:
         print(f"FAIL: patch['{CANON_KEY}']['{target_fn}'] -> {type(e).__name__}: {e}")
@@ -45,6 +60,7 @@ def main():
     # Access attempt using canonical key
     try:
         _ = mutated_patch[CANON_KEY][target_fn]
+        status["mutated"] = True
         print(
             f"OK: patch['{CANON_KEY}']['{target_fn}'] exists "
             "(unexpected if schema drift applied)"
@@ -73,6 +89,7 @@ def main():
     print("\n[REPAIRED]")
     try:
         _ = repaired_patch[CANON_KEY][target_fn]
+        status["repaired"] = True
         print(f"OK: patch['{CANON_KEY}']['{target_fn}'] exists")
     except Exception as e:
         print(
@@ -80,6 +97,8 @@ def main():
             f"-> {type(e).__name__}: {e}"
         )
 
+    return status
+
 
 if __name__ == "__main__":
     main()
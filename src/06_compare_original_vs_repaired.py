@@ -1,12 +1,23 @@
-import json
 import os
 import hashlib
-from typing import Dict, Any, Tuple, List
+import heapq
+from typing import Dict, Any, KeysView, Optional, Tuple, List
 
-from schema_drift_config import CANON_KEY, EXTRA_STRUCT_KEYS
+from patch_io import DATA_DIR, handoff_path, load_patch_file
+from schema_drift_config import CANON_KEY, EXTRA_STRUCT_KEYS_SET
 
-ORIG_JSON = os.path.join("data", "patch_reference.json")
-REPAIRED_JSON = os.path.join("data", "patch_repaired.json")
+ORIG_JSON = os.path.join(DATA_DIR, "patch_reference.json")
+REPAIRED_PATCH = "patch_repaired"  # looked up in the trial directory
+
+# Function record fields compared by sample_field_checks
+SAMPLE_FIELDS = (
+    "func_module",
+    "func_qualname",
+    "co_argcount",
+    "co_kwonlyargcount",
+    "co_flags",
+)
+CO_CODE_FIELDS = ("len", "preview_hex")
 
 
 def sha256_of_strings(strings: List[str]) -> str:
@@ -20,41 +31,38 @@ def sha256_of_strings(strings: List[str]) -> str:
     :return: Hex digest of SHA-256 hash.
     :rtype: str
     """
-    hash = hashlib.sha256()
-    for s in strings:
-        hash.update(s.encode("utf-8"))
-        hash.update(b"\n")
-    return hash.hexdigest()
+    # Same digest as hashing "<s>\n" per string, but one encode and one update call
+    if not strings:
+        return hashlib.sha256().hexdigest()
+    return hashlib.sha256(("\n".join(strings) + "\n").encode("utf-8")).hexdigest()
 
 
 def load_patch(path: str) -> Dict[str, Any]:
     """
-    Load a JSON-wrapped patch file and return underlying patch dict.
+    Load a JSON-wrapped (or pickled) patch file and return underlying patch dict.
     
-    :param path: Path to JSON field
+    :param path: Path to JSON or pickle file
     :type path: str
     :return: Extracted patch dictionary
     :rtype: Dict[str, Any]
     """
-    with open(path, "r", encoding="utf-8") as f:
-        obj = json.load(f)
-    return obj["patch"]
+    return load_patch_file(path)["patch"]
 
 
-def summarize_functions(patch: Dict[str, Any]) -> Tuple[int, List[str], str]:
+def summarize_functions(patch: Dict[str, Any]) -> Tuple[int, KeysView[str], str]:
     """
-    Summarize functions container by various parameters (count, sorted keys, keyset hash).
+    Summarize functions container by various parameters (count, keyset, keyset hash).
+    The keyset is the container's live keys view, which supports set operations without a copy.
     
     :param patch: Patch dictionary to be summarized
     :type patch: Dict[str, Any]
-    :return: Number of function keys, sorted list of function keys, SHA-256 hash of sorted keys
-    :rtype: Tuple[int, List[str], str]
+    :return: Number of function keys, view of function keys, SHA-256 hash of sorted keys
+    :rtype: Tuple[int, KeysView[str], str]
     """
     fns = patch.get(CANON_KEY, {})
     if not isinstance(fns, dict):
-        return (0, [], "NOT_A_DICT")
-    keys = sorted(fns.keys())
-    return (len(keys), keys, sha256_of_strings(keys))
+        return (0, {}.keys(), "NOT_A_DICT")
+    return (len(fns), fns.keys(), sha256_of_strings(sorted(fns)))
 
 
 def sample_field_checks(orig: Dict[str, Any], repaired: Dict[str, Any], fn_name: str) -> List[str]:
@@ -70,46 +78,59 @@ def sample_field_checks(orig: Dict[str, Any], repaired: Dict[str, Any], fn_name:
     :return: Comparison lines to show if matched or different. 
     :rtype: List[str]
     """
-    logs: List[str] = []
+    o_fns = orig.get(CANON_KEY)
+    r_fns = repaired.get(CANON_KEY)
+    if not isinstance(o_fns, dict) or not isinstance(r_fns, dict):
+        return [f"Sample '{fn_name}': missing or not dict"]
 
-    o = orig.get(CANON_KEY, {}).get(fn_name)
-    r = repaired.get(CANON_KEY, {}).get(fn_name)
+    o = o_fns.get(fn_name)
+    r = r_fns.get(fn_name)
 
     if not isinstance(o, dict) or not isinstance(r, dict):
         return [f"Sample '{fn_name}': missing or not dict"]
 
-    fields = [
-        "func_module",
-        "func_qualname",
-        "co_argcount",
-        "co_kwonlyargcount",
-        "co_flags",
-    ]
-
-    for k in fields:
-        ov = o.get(k)
-        rv = r.get(k)
-        logs.append(
-            f"  {fn_name}.{k}: {'MATCH' if ov == rv else 'DIFF'} "
+    o_code = o.get("co_code", {})
+    r_code = r.get("co_code", {})
+    with_code = isinstance(o_code, dict) and isinstance(r_code, dict)
+
+    # Line count is known up front: one per field, plus the co_code fields if comparable
+    n = len(SAMPLE_FIELDS)
+    logs: List[str] = [""] * (n + len(CO_CODE_FIELDS) if with_code else n)
+
+    # Fetch all fields with one C-level map per record (missing fields read as None), and
+    # settle the common all-equal case with a single tuple compare
+    o_vals = tuple(map(o.get, SAMPLE_FIELDS))
+    r_vals = tuple(map(r.get, SAMPLE_FIELDS))
+    all_match = o_vals == r_vals
+    for i, (k, ov, rv) in enumerate(zip(SAMPLE_FIELDS, o_vals, r_vals)):
+        logs[i] = (
+            f"  {fn_name}.{k}: {'MATCH' if all_match or ov == rv else 'DIFF'} "
             f"(orig={ov!r}, repaired={rv!r})"
         )
 
-    o_code = o.get("co_code", {})
-    r_code = r.get("co_code", {})
-    if isinstance(o_code, dict) and isinstance(r_code, dict):
-        for k in ["len", "preview_hex"]:
-            ov = o_code.get(k)
-            rv = r_code.get(k)
-            logs.append(
-                f"  {fn_name}.co_code.{k}: {'MATCH' if ov == rv else 'DIFF'}"
-            )
+    if with_code:
+        o_vals = tuple(map(o_code.get, CO_CODE_FIELDS))
+        r_vals = tuple(map(r_code.get, CO_CODE_FIELDS))
+        all_match = o_vals == r_vals
+        for i, (k, ov, rv) in enumerate(zip(CO_CODE_FIELDS, o_vals, r_vals), n):
+            logs[i] = f"  {fn_name}.co_code.{k}: {'MATCH' if all_match or ov == rv else 'DIFF'}"
 
     return logs
 
 
-def main():
-    orig = load_patch(ORIG_JSON)
-    repaired = load_patch(REPAIRED_JSON)
+def main(trial_dir: str = DATA_DIR, original_patch: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """
+    Compare the original and repaired patches and report PASS/FAIL per check.
+
+    :param trial_dir: Directory holding the repaired patch
+    :type trial_dir: str
+    :param original_patch: Already-parsed reference patch (read from ORIG_JSON if omitted)
+    :type original_patch: Optional[Dict[str, Any]]
+    :return: Verdicts keyed by check name ("functions_keyset", "top_level_keys")
+    :rtype: Dict[str, str]
+    """
+    orig = original_patch if original_patch is not None else load_patch(ORIG_JSON)
+    repaired = load_patch(handoff_path(REPAIRED_PATCH, trial_dir))
 
     o_n, o_keys, o_hash = summarize_functions(orig)
     r_n, r_keys, r_hash = summarize_functions(repaired)
@@ -120,34 +141,43 @@ def main():
     print(f"  original keys sha256: {o_hash}")
     print(f"  repaired  keys sha256: {r_hash}")
 
-    if o_keys == r_keys:
+    verdicts: Dict[str, str] = {}
+
+    # Count/hash mismatch rejects without touching the keys. A hash match is confirmed with a
+    # set compare, since newline-joined keys are not an injective encoding.
+    if o_n == r_n and o_hash == r_hash and o_keys == r_keys:
+        verdicts["functions_keyset"] = "PASS"
         print("  PASS: functions keyset EXACT MATCH")
     else:
+        verdicts["functions_keyset"] = "FAIL"
         print("  FAIL: functions keyset DIFFER")
-        o_set = set(o_keys)
-        r_set = set(r_keys)
-        print(f"    missing in repaired: {sorted(list(o_set - r_set))[:25]}")
-        print(f"    extra in repaired:   {sorted(list(r_set - o_set))[:25]}")
+        # Only the first 25 of each difference are shown, so skip sorting the whole thing.
+        # Generators feed nsmallest directly instead of materializing the difference sets.
+        print(f"    missing in repaired: {heapq.nsmallest(25, (k for k in o_keys if k not in r_keys))}")
+        print(f"    extra in repaired:   {heapq.nsmallest(25, (k for k in r_keys if k not in o_keys))}")
 
     # Top level key check. Ignore the noise keys.
     print("\n[TOP-LEVEL PATCH KEYS CHECK]")
-    o_top = sorted([k for k in orig.keys() if k not in EXTRA_STRUCT_KEYS])
-    r_top = sorted([k for k in repaired.keys() if k not in EXTRA_STRUCT_KEYS])
+    # Keys are unique, so set equality is the same check as comparing the sorted lists
+    o_top = orig.keys() - EXTRA_STRUCT_KEYS_SET
+    r_top = repaired.keys() - EXTRA_STRUCT_KEYS_SET
 
     if o_top == r_top:
+        verdicts["top_level_keys"] = "PASS"
         print("  PASS: top-level patch keys match (excluding ignorable noise)")
     else:
+        verdicts["top_level_keys"] = "FAIL"
         print("  FAIL: top-level patch keys differ (excluding ignorable noise)")
-        print(f"    missing in repaired: {sorted(list(set(o_top) - set(r_top)))[:25]}")
-        print(f"    extra in repaired:   {sorted(list(set(r_top) - set(o_top)))[:25]}")
+        print(f"    missing in repaired: {heapq.nsmallest(25, (k for k in o_top if k not in r_top))}")
+        print(f"    extra in repaired:   {heapq.nsmallest(25, (k for k in r_top if k not in o_top))}")
 
     """sample_name = (
         "emojis"
         if "emojis" in orig.get(CANON_KEY, {})
-        else (o_keys[0] if o_keys else None)
+        else (min(o_keys) if o_keys else None)
     )"""
 
-    sample_name = o_keys[0] if o_keys else None
+    sample_name = min(o_keys) if o_keys else None
 
     print(f"\n[SAMPLE FUNCTION FIELD CHECK: {sample_name}]")
     if sample_name is None:
@@ -156,6 +186,8 @@ def main():
         for line in sample_field_checks(orig, repaired, sample_name):
             print(line)
 
+    return verdicts
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,203 @@
+import json
+import math
+import os
+import pickle
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+# Set FAST_FORMAT=1 to hand the mutated/repaired patches between stages as pickles instead
+# of indented JSON. patch_reference.json and the logs/plans stay JSON for debuggability.
+FAST_FORMAT = os.environ.get("FAST_FORMAT", "").strip().lower() in ("1", "true", "yes")
+
+# load_json guard: digits become "0", value separators / whitespace / "-" become ":", everything
+# else "x". A run of 19+ digits right after a separator may be an integer outside the int64/uint64
+# range, which orjson would silently turn into a float. Digit runs inside words (hex previews,
+# identifiers) follow a letter or quote and are not flagged.
+_NUMBER_MASK = bytes(
+    48 if 48 <= b <= 57 else 58 if b in b":[, \t\r\n-" else 120 for b in range(256)
+)
+_WIDE_NUMBER = b":" + b"0" * 19
+
+# Default directory for pipeline inputs/outputs. Parallel trials use data/trial_<t>/ instead.
+DATA_DIR = "data"
+
+
+def handoff_path(stem: str, data_dir: str = DATA_DIR) -> str:
+    """
+    Path for an intermediate patch file in the active handoff format.
+
+    :param stem: File name without extension (e.g. "patch_mutated")
+    :type stem: str
+    :param data_dir: Directory holding the file (data/ or a per-trial directory)
+    :type data_dir: str
+    :return: <data_dir>/<stem>.pkl when FAST_FORMAT is set, otherwise <data_dir>/<stem>.json
+    :rtype: str
+    """
+    return os.path.join(data_dir, stem + (".pkl" if FAST_FORMAT else ".json"))
+
+
+def _has_nonfinite(obj: Any) -> bool:
+    """
+    Check whether obj contains a NaN or +/-Infinity float anywhere in its dicts/lists/tuples.
+
+    :param obj: JSON-serializable object
+    :type obj: Any
+    :return: True if a non-finite float is present
+    :rtype: bool
+    """
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, float):
+            if not math.isfinite(o):
+                return True
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return False
+
+
+def dump_json(obj: Any, path: str, sort_keys: bool = False) -> None:
+    """
+    Write obj as indented UTF-8 JSON using orjson (one encode + one write).
+
+    :param obj: JSON-serializable object
+    :type obj: Any
+    :param path: Destination path
+    :type path: str
+    :param sort_keys: Sort dict keys in the output
+    :type sort_keys: bool
+    """
+    option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    data: Optional[bytes]
+    try:
+        data = orjson.dumps(obj, option=option)
+        # orjson silently writes NaN/Infinity as null; only then is the walk worth doing
+        if b"null" in data and _has_nonfinite(obj):
+            data = None
+    except orjson.JSONEncodeError:
+        # orjson rejects integers wider than 64 bits; the stdlib encoder does not
+        data = None
+    if data is None:
+        # The stdlib encoder keeps wide integers and writes NaN/Infinity as the baseline did
+        data = json.dumps(obj, indent=2, ensure_ascii=False, sort_keys=sort_keys).encode("utf-8")
+    Path(path).write_bytes(data)
+
+
+def load_json(path: str) -> Any:
+    """
+    Read a JSON file as raw bytes and parse it, skipping the text-mode decode layer.
+    Parsed with orjson unless the file may hold an integer orjson cannot represent exactly
+    (or orjson rejects it, e.g. NaN or lone surrogates); those go through the stdlib decoder.
+
+    :param path: Source path
+    :type path: str
+    :return: Parsed JSON value
+    :rtype: Any
+    """
+    data = Path(path).read_bytes()
+    masked = data.translate(_NUMBER_MASK)
+    if _WIDE_NUMBER not in masked and not masked.startswith(_WIDE_NUMBER[1:]):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dump_pickle(obj: Any, path: str, out_of_band: bool = False) -> None:
+    """
+    Pickle obj with protocol 5. With out_of_band, PEP 3118 buffers (e.g. ndarray data) are
+    written zero-copy to a <path>.bufs sidecar instead of being copied into the pickle stream.
+    The pickle then cannot be loaded without the sidecar (load_pickle(..., out_of_band=True)),
+    hence opt-in.
+
+    :param obj: Object to pickle
+    :type obj: Any
+    :param path: Destination path
+    :type path: str
+    :param out_of_band: Write buffer-protocol payloads to the sidecar file
+    :type out_of_band: bool
+    """
+    if not out_of_band:
+        with open(path, "wb") as f:
+            pickle.dump(obj, f, protocol=5)
+        return
+
+    buffers: List[pickle.PickleBuffer] = []
+    with open(path, "wb") as f:
+        pickle.dump(obj, f, protocol=5, buffer_callback=buffers.append)
+
+    # Always (re)written in this mode, even when empty, so a stale sidecar is never paired
+    # with a newer pickle
+    with open(path + ".bufs", "wb") as f:
+        for b in buffers:
+            raw = b.raw()
+            f.write(struct.pack("<Q", raw.nbytes))
+            f.write(raw)
+
+
+def load_pickle(path: str, out_of_band: bool = False) -> Any:
+    """
+    Load a pickle written by dump_pickle. With out_of_band, buffers are read from the <path>.bufs
+    sidecar into one writeable bytearray, so unpickled arrays are writeable too.
+
+    :param path: Source path
+    :type path: str
+    :param out_of_band: The pickle was written with dump_pickle(..., out_of_band=True)
+    :type out_of_band: bool
+    :return: Unpickled object
+    :rtype: Any
+    """
+    buffers: Optional[List[memoryview]] = None
+    if out_of_band:
+        with open(path + ".bufs", "rb") as f:
+            data = bytearray(os.fstat(f.fileno()).st_size)
+            f.readinto(data)
+        view = memoryview(data)
+        buffers = []
+        pos = 0
+        while pos < len(view):
+            (n,) = struct.unpack_from("<Q", view, pos)
+            pos += 8
+            buffers.append(view[pos:pos + n])
+            pos += n
+
+    with open(path, "rb") as f:
+        return pickle.load(f, buffers=buffers)
+
+
+def save_patch_file(obj: Dict[str, Any], path: str) -> None:
+    """
+    Write a JSON-wrapped patch ({"patch": ...}) to disk, picking the format from the extension.
+    Pickles hold only the bare patch dict, i.e. exactly what 04_json_to_pkl produces.
+
+    :param obj: Wrapped patch object
+    :type obj: Dict[str, Any]
+    :param path: Destination (.pkl or .json)
+    :type path: str
+    """
+    if path.endswith(".pkl"):
+        dump_pickle(obj["patch"], path)
+    else:
+        dump_json(obj, path)
+
+
+def load_patch_file(path: str) -> Dict[str, Any]:
+    """
+    Read a patch written by save_patch_file (or any JSON-wrapped patch such as patch_reference.json).
+
+    :param path: Source (.pkl or .json)
+    :type path: str
+    :return: Wrapped patch object; pickles are re-wrapped as {"patch": ...}
+    :rtype: Dict[str, Any]
+    """
+    if path.endswith(".pkl"):
+        return {"patch": load_pickle(path)}
+    return load_json(path)
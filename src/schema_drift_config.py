@@ -10,6 +10,7 @@ RENAME_VARIANTS = [
     "functions_map",
     "functions_dict",
 ]
+RENAME_VARIANTS_SET = frozenset(RENAME_VARIANTS)
 
 WRAPPER_VARIANTS = [
     "wrapper",
@@ -19,6 +20,7 @@ WRAPPER_VARIANTS = [
     "wrapped",
     "temp_wrapper",
 ]
+WRAPPER_VARIANTS_SET = frozenset(WRAPPER_VARIANTS)
 
 EXTRA_STRUCT_KEYS = [
     "extra_struct_1",
@@ -26,14 +28,19 @@ EXTRA_STRUCT_KEYS = [
     "temp_block",
     "temp_struct",
 ]
+EXTRA_STRUCT_KEYS_SET = frozenset(EXTRA_STRUCT_KEYS)
 
 
 def find_functions_key(patch: dict) -> Optional[str]:
     """Return the key under which the functions container currently lives."""
     if CANON_KEY in patch:
         return CANON_KEY
+    hits = patch.keys() & RENAME_VARIANTS_SET
+    if not hits:
+        return None
+    # Keep RENAME_VARIANTS priority if several variants are present
     for k in RENAME_VARIANTS:
-        if k in patch:
+        if k in hits:
             return k
     return None
 
@@ -42,8 +49,11 @@ def find_wrapper_key(functions_container: dict) -> Optional[str]:
     """Return a wrapper key if the functions container is wrapped."""
     if not isinstance(functions_container, dict):
         return None
+    # Intersect first: the container is usually the (large) unwrapped functions dict
+    hits = functions_container.keys() & WRAPPER_VARIANTS_SET
+    if not hits:
+        return None
     for k in WRAPPER_VARIANTS:
-        v = functions_container.get(k)
-        if isinstance(v, dict):
+        if k in hits and isinstance(functions_container[k], dict):
             return k
     return None
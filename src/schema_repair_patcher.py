@@ -1,25 +1,99 @@
+import copy
+import functools
+import hashlib
 import json
 import os
-from typing import Any, Dict, List
+import re
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, List, Optional
 
-from google import genai
+import orjson
 
 from schema_drift_config import (
     CANON_KEY,
     EXTRA_STRUCT_KEYS,
+    EXTRA_STRUCT_KEYS_SET,
     RENAME_VARIANTS,
-    find_functions_key,
+    RENAME_VARIANTS_SET,
     find_wrapper_key,
 )
 
 
+@functools.cache
+def _get_genai() -> Any:
+    """
+    Imports the Gemini SDK on first use. Offline callers (plan application, JSON extraction)
+    never pay for loading it.
+
+    :return: The google.genai module
+    :rtype: module
+    """
+    from google import genai
+    return genai
+
+
+# Sentinel for dict.pop when a missing key must be told apart from a stored None
+_MISSING = object()
+
+# Characters that matter when locating a JSON object in free text
+_JSON_TOKEN = re.compile(r'["\\{}]')
+
+
 class SchemaRepairPatcher:
     """
     Core logic for inferring a repair plan from a mutated patch by handing off to an LLM (Gemini 2.0 in this case). 
     Using that plan, apply it deterministically in order to produce a repaired patch.
     """
 
-    def __init__(self, model_id: str = "models/gemini-2.0-flash", api_key_env: str = "GEMINI_API_KEY"):
+    # Prompt to feed the LLM. Developed by asking Gemini what would be a good prompt 
+    # when fed the mutated JSON with the options of possible scehma drift.
+    # Built once; only the excerpt JSON goes between prefix and suffix per call.
+    _PROMPT_PREFIX = f"""You are diagnosing schema drift in a recovered patch dictionary.
+
+Canonical requirements:
+- patch must contain a key named "{CANON_KEY}"
+- patch["{CANON_KEY}"] must be a dict mapping function_name -> function_record
+- patch["{CANON_KEY}"] must NOT be wrapped under an extra layer
+- Extra top-level keys may exist and should be ignored unless they replace "{CANON_KEY}"
+
+Observed excerpt from mutated patch (schema-only, not full content):
+"""
+
+    _PROMPT_SUFFIX = f"""
+
+Return ONLY valid JSON with schema:
+
+{{
+  "actions": [
+    {{
+      "op": "rename_key",
+      "path": [],
+      "from": "<use excerpt.functions_container_key>",
+      "to": "{CANON_KEY}"
+    }},
+    {{
+      "op": "unwrap",
+      "path": ["{CANON_KEY}"],
+      "wrapper_key": "<wrapper_key>"
+    }}
+  ]
+}}
+
+Rules:
+- Include ONLY actions necessary based on the excerpt.
+- If "{CANON_KEY}" is missing but a renamed key is present, include rename_key using that key.
+- If the functions container appears wrapped:
+  - Prefer wrapper_key from "single_key_wrapper_heuristic.wrapper_key" if present.
+  - Otherwise use a wrapper key that appears under the functions container.
+- Do NOT include actions for extra_struct keys; they are ignorable noise.
+- Do not propose renames to keys other than "{CANON_KEY}".
+- Return at most one rename_key action and at most one unwrap action.
+- If wrapper_key_detected_by_list is non-null, include an unwrap action using that wrapper_key.
+- If no repair is needed, return {{ "actions": [] }}."""
+
+    def __init__(self, model_id: str = "models/gemini-2.0-flash", api_key_env: str = "GEMINI_API_KEY",
+                 plan_cache_size: int = 0, plan_cache_path: Optional[str] = None):
         """
         Initializes the SchemaRepairPatcher with LLM configuration.
 
@@ -27,9 +101,38 @@ class SchemaRepairPatcher:
         :type model_id: str
         :param api_key_env: Environment variable name containing the Gemini API key
         :type api_key_env: str
+        :param plan_cache_size: Max plans memoized by excerpt (LRU). 0 disables the cache, so every
+            call asks the LLM; trials measuring LLM repair accuracy should leave it off
+        :type plan_cache_size: int
+        :param plan_cache_path: Optional JSON file the plan cache is loaded from and saved to
+        :type plan_cache_path: Optional[str]
         """
         self.model_id = model_id
         self.api_key_env = api_key_env
+        self._api_key = os.environ.get(api_key_env)
+        self._client: Any = None
+
+        self.plan_cache_size = plan_cache_size
+        self.plan_cache_path = plan_cache_path
+        self._plan_cache: "OrderedDict[str, dict]" = OrderedDict()
+        if plan_cache_size > 0 and plan_cache_path:
+            self._plan_cache.update(self._read_plan_file(plan_cache_path))
+            while len(self._plan_cache) > plan_cache_size:
+                self._plan_cache.popitem(last=False)
+
+    def _get_client(self) -> Any:
+        """
+        Returns the Gemini client, creating it on first use so later calls reuse its connection.
+
+        :return: Cached Gemini client
+        :rtype: genai.Client
+        :raises RuntimeError: If the Gemini API key env var is missing
+        """
+        if self._client is None:
+            if not self._api_key:
+                raise RuntimeError(f"Missing environment variable: {self.api_key_env}")
+            self._client = _get_genai().Client(api_key=self._api_key)
+        return self._client
 
 
     def extract_excerpt(self, patch: dict) -> dict:
@@ -43,23 +146,33 @@ class SchemaRepairPatcher:
         :return: A compact JSON-serializable excerpt 
         :rtype: dict
         """
-        excerpt: Dict[str, Any] = {
-            "top_level_patch_keys_sample": list(patch.keys())[:40],
-            "has_canonical_functions": CANON_KEY in patch,
-            "possible_renamed_functions_keys_present": [k for k in RENAME_VARIANTS if k in patch],
-            "extra_struct_keys_present": [k for k in EXTRA_STRUCT_KEYS if k in patch],
-        }
+        keys = patch.keys()
+        has_canon = CANON_KEY in patch
 
-        # Identify where the "functions container" currently lives 
-        functions_key = find_functions_key(patch)
-        excerpt["functions_container_key"] = functions_key
+        # Intersections are C-level; the hits are re-emitted in the variant lists' order so the
+        # excerpt (and prompt) is stable
+        rename_hits = keys & RENAME_VARIANTS_SET
+        renames = [k for k in RENAME_VARIANTS if k in rename_hits] if rename_hits else []
+        extra_hits = keys & EXTRA_STRUCT_KEYS_SET
 
-        functions_container = patch.get(functions_key) if functions_key else None
-        excerpt["functions_container_type"] = str(type(functions_container))
+        # Identify where the "functions container" currently lives (same rule as find_functions_key:
+        # canonical key first, then the highest-priority rename variant)
+        functions_key = CANON_KEY if has_canon else (renames[0] if renames else None)
+        functions_container = patch[functions_key] if functions_key else None
+
+        excerpt: Dict[str, Any] = {
+            "top_level_patch_keys_sample": list(islice(keys, 40)),
+            "has_canonical_functions": has_canon,
+            "possible_renamed_functions_keys_present": renames,
+            "extra_struct_keys_present": [k for k in EXTRA_STRUCT_KEYS if k in extra_hits] if extra_hits else [],
+            "functions_container_key": functions_key,
+            "functions_container_type": str(type(functions_container)),
+        }
 
         if isinstance(functions_container, dict):
-            keys = list(functions_container.keys())
-            excerpt["functions_container_keys_sample"] = keys[:25]
+            # Only a sample is needed, so never copy the full (possibly huge) key list
+            keys_sample = list(islice(functions_container, 25))
+            excerpt["functions_container_keys_sample"] = keys_sample
 
             # Wrapper detection from known wrapper variants
             wk = find_wrapper_key(functions_container)
@@ -67,12 +180,14 @@ class SchemaRepairPatcher:
 
             # Strong heuristic for determining wrapper schema. 
             # If single-key dict and inner is dict, then assume wrapper schema
-            if len(keys) == 1 and isinstance(functions_container.get(keys[0]), dict):
-                heuristic_wrapper_key = keys[0]
-                excerpt["single_key_wrapper_heuristic"] = {
-                    "wrapper_key": heuristic_wrapper_key,
-                    "inner_keys_sample": list(functions_container[heuristic_wrapper_key].keys())[:25],
-                }
+            if len(functions_container) == 1:
+                heuristic_wrapper_key = keys_sample[0]
+                inner = functions_container[heuristic_wrapper_key]
+                if isinstance(inner, dict):
+                    excerpt["single_key_wrapper_heuristic"] = {
+                        "wrapper_key": heuristic_wrapper_key,
+                        "inner_keys_sample": list(islice(inner, 25)),
+                    }
 
         return excerpt
 
@@ -89,68 +204,99 @@ class SchemaRepairPatcher:
         """
         excerpt = self.extract_excerpt(patch)
 
-        # Prompt to feed the LLM. Developed by asking Gemini what would be a good prompt 
-        # when fed the mutated JSON with the options of possible scehma drift. 
-        prompt = f"""
-You are diagnosing schema drift in a recovered patch dictionary.
+        # The plan only depends on the excerpt, so identical excerpts can reuse a plan
+        cache_key = None
+        if self.plan_cache_size > 0:
+            cache_key = hashlib.sha256(
+                json.dumps(excerpt, sort_keys=True, separators=(",", ":")).encode("utf-8")
+            ).hexdigest()
+            cached = self._plan_cache.get(cache_key)
+            if cached is not None:
+                self._plan_cache.move_to_end(cache_key)
+                return copy.deepcopy(cached)
 
-Canonical requirements:
-- patch must contain a key named "{CANON_KEY}"
-- patch["{CANON_KEY}"] must be a dict mapping function_name -> function_record
-- patch["{CANON_KEY}"] must NOT be wrapped under an extra layer
-- Extra top-level keys may exist and should be ignored unless they replace "{CANON_KEY}"
+        prompt = f"{self._PROMPT_PREFIX}{orjson.dumps(excerpt, option=orjson.OPT_INDENT_2).decode()}{self._PROMPT_SUFFIX}"
 
-Observed excerpt from mutated patch (schema-only, not full content):
-{json.dumps(excerpt, indent=2)}
-
-Return ONLY valid JSON with schema:
-
-{{
-  "actions": [
-    {{
-      "op": "rename_key",
-      "path": [],
-      "from": "<use excerpt.functions_container_key>",
-      "to": "{CANON_KEY}"
-    }},
-    {{
-      "op": "unwrap",
-      "path": ["{CANON_KEY}"],
-      "wrapper_key": "<wrapper_key>"
-    }}
-  ]
-}}
-
-Rules:
-- Include ONLY actions necessary based on the excerpt.
-- If "{CANON_KEY}" is missing but a renamed key is present, include rename_key using that key.
-- If the functions container appears wrapped:
-  - Prefer wrapper_key from "single_key_wrapper_heuristic.wrapper_key" if present.
-  - Otherwise use a wrapper key that appears under the functions container.
-- Do NOT include actions for extra_struct keys; they are ignorable noise.
-- Do not propose renames to keys other than "{CANON_KEY}".
-- Return at most one rename_key action and at most one unwrap action.
-- If wrapper_key_detected_by_list is non-null, include an unwrap action using that wrapper_key.
-- If no repair is needed, return {{ "actions": [] }}.
-""".strip()
-
-        api_key = os.environ.get(self.api_key_env)
-        if not api_key:
-            raise RuntimeError(f"Missing environment variable: {self.api_key_env}")
-
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(model=self.model_id, contents=prompt)
+        response = self._get_client().models.generate_content(model=self.model_id, contents=prompt)
 
         raw_text = (response.text or "").strip()
         json_text = self._extract_json_object(raw_text)
-        plan = json.loads(json_text)
+        try:
+            plan = json.loads(json_text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Extracted JSON is invalid: {e}")
 
         # Validating plan output to make sure it is viable
         if not isinstance(plan, dict) or "actions" not in plan or not isinstance(plan["actions"], list):
             raise ValueError("LLM returned invalid plan shape (expected dict with 'actions': list).")
 
+        if cache_key is not None:
+            self._store_plan(cache_key, plan)
+
         return plan
 
+    @staticmethod
+    def _read_plan_file(path: str) -> Dict[str, dict]:
+        """
+        Reads a persisted plan cache.
+
+        :param path: Plan cache JSON file
+        :type path: str
+        :return: Plans keyed by excerpt hash, oldest first; empty if the file does not exist yet
+            or is unreadable. Entries without an "actions" list are dropped.
+        :rtype: Dict[str, dict]
+        """
+        try:
+            with open(path, "rb") as f:
+                cached = json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Ignoring unreadable plan cache {path}: {e}")
+            return {}
+        if not isinstance(cached, dict):
+            print(f"Ignoring plan cache {path}: expected an object, got {type(cached).__name__}")
+            return {}
+        return {
+            k: v
+            for k, v in cached.items()
+            if isinstance(v, dict) and isinstance(v.get("actions"), list)
+        }
+
+    def _store_plan(self, key: str, plan: dict) -> None:
+        """
+        Adds a validated plan to the LRU plan cache and persists the cache if a path is set.
+
+        :param key: SHA-256 hex digest of the canonical excerpt JSON
+        :type key: str
+        :param plan: Plan returned by the LLM (copied, so the caller may mutate it)
+        :type plan: dict
+        """
+        self._plan_cache[key] = copy.deepcopy(plan)
+        self._plan_cache.move_to_end(key)
+        while len(self._plan_cache) > self.plan_cache_size:
+            self._plan_cache.popitem(last=False)
+
+        if self.plan_cache_path:
+            # Parallel workers share the file but each has its own in-memory cache. Fold in what
+            # the others have saved since (as older entries) so the rewrite does not drop their
+            # plans. Two workers saving at the same instant can still lose one plan, which only
+            # costs a later cache miss.
+            merged: "OrderedDict[str, dict]" = OrderedDict(
+                (k, v) for k, v in self._read_plan_file(self.plan_cache_path).items() if k not in self._plan_cache
+            )
+            merged.update(self._plan_cache)
+            while len(merged) > self.plan_cache_size:
+                merged.popitem(last=False)
+            self._plan_cache = merged
+
+            # Write-then-rename so parallel trials never see a half-written file
+            os.makedirs(os.path.dirname(self.plan_cache_path) or ".", exist_ok=True)
+            tmp = f"{self.plan_cache_path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps(self._plan_cache))
+            os.replace(tmp, self.plan_cache_path)
+
 
     def apply_plan_to_patch(self, patch: dict, plan: dict) -> List[str]:
         """
@@ -168,17 +314,30 @@ Rules:
         if not isinstance(actions, list):
             raise ValueError("Plan 'actions' must be a list.")
 
-        # Ensure deterministic order. Rename first, then unwrap
-        priority = {"rename_key": 0, "unwrap": 1}
-        actions = sorted(actions, key=lambda a: priority.get(a.get("op") if isinstance(a, dict) else None, 99))
-
-        logs: List[str] = []
-
-        for i, a in enumerate(actions):
-            if not isinstance(a, dict):
-                logs.append(f"[{i}] invalid action (not a dict). Skipped")
+        # Ensure deterministic order. Rename first, then unwrap, then anything else (stable partition).
+        # Actions come from json.loads, so valid ones are exactly dict; the rest are only counted.
+        renames: List[Dict[str, Any]] = []
+        unwraps: List[Dict[str, Any]] = []
+        others: List[Dict[str, Any]] = []
+        invalid = 0
+        for a in actions:
+            if type(a) is not dict:
+                invalid += 1
                 continue
+            op = a.get("op")
+            if op == "rename_key":
+                renames.append(a)
+            elif op == "unwrap":
+                unwraps.append(a)
+            else:
+                others.append(a)
+
+        # Exactly one log line per action; invalid actions are logged up front
+        logs: List[str] = [""] * len(actions)
+        for i in range(invalid):
+            logs[i] = f"[{i}] invalid action (not a dict). Skipped"
 
+        for i, a in enumerate(renames + unwraps + others, invalid):
             op = a.get("op")
 
             if op == "rename_key":
@@ -186,71 +345,79 @@ Rules:
                 dst = a.get("to")
 
                 if not src or not dst:
-                    logs.append(f"[{i}] rename_key missing from/to. Skipped")
+                    logs[i] = f"[{i}] rename_key missing from/to. Skipped"
                     continue
 
-                if src in patch and dst not in patch:
-                    patch[dst] = patch.pop(src)
-                    logs.append(f"[{i}] rename_key '{src}' -> '{dst}'. Applied")
+                # Check dst first so a refused rename never pops/reinserts (and reorders) src
+                value = _MISSING if dst in patch else patch.pop(src, _MISSING)
+                if value is not _MISSING:
+                    patch[dst] = value
+                    logs[i] = f"[{i}] rename_key '{src}' -> '{dst}'. Applied"
                 else:
-                    logs.append(f"[{i}] rename_key '{src}' -> '{dst}'. No change")
+                    logs[i] = f"[{i}] rename_key '{src}' -> '{dst}'. No change"
 
             elif op == "unwrap":
                 path = a.get("path", [])
                 wrapper_key = a.get("wrapper_key")
 
                 if path != [CANON_KEY] or not wrapper_key:
-                    logs.append(f"[{i}] unwrap invalid (path/wrapper_key). Skipped")
+                    logs[i] = f"[{i}] unwrap invalid (path/wrapper_key). Skipped"
                     continue
 
                 container = patch.get(CANON_KEY)
-                if isinstance(container, dict) and wrapper_key in container and isinstance(container[wrapper_key], dict):
-                    patch[CANON_KEY] = container[wrapper_key]
-                    logs.append(f"[{i}] unwrap ['{CANON_KEY}'] wrapper='{wrapper_key}'. Applied")
+                inner = container.get(wrapper_key) if isinstance(container, dict) else None
+                if isinstance(inner, dict):
+                    patch[CANON_KEY] = inner
+                    logs[i] = f"[{i}] unwrap ['{CANON_KEY}'] wrapper='{wrapper_key}'. Applied"
                 else:
-                    logs.append(f"[{i}] unwrap ['{CANON_KEY}'] wrapper='{wrapper_key}'. No change")
+                    logs[i] = f"[{i}] unwrap ['{CANON_KEY}'] wrapper='{wrapper_key}'. No change"
 
             else:
-                logs.append(f"[{i}] unknown op '{op}'. Skipped")
+                logs[i] = f"[{i}] unknown op '{op}'. Skipped"
 
         return logs
 
     def _extract_json_object(self, text: str) -> str:
         """
-        Extracts the first JSON object substring from raw model output text.
+        Extracts the first JSON object substring from raw model output text in a single pass.
+        Only JSON-significant characters are visited; string state is tracked once inside an
+        object so braces in string values do not count, and prose/code fences around the object
+        are skipped. The caller parses the result.
 
         :param text: Raw model output that may contain extra prose
         :type text: str
         :return: Substring containing the first JSON object
         :rtype: str
-        :raises ValueError: If no JSON object boundaries are found
+        :raises ValueError: If no complete JSON object is found
         """
-        # Strip Markdown code fences if present
-        stripped = text.strip()
-        if stripped.startswith("```"):
-            lines = stripped.splitlines()
-            # Remove first and last fence lines
-            if len(lines) >= 3:
-                stripped = "\n".join(lines[1:-1]).strip()
-
-        # Try to parse entire string
-        try:
-            json.loads(stripped)
-            return stripped
-        except Exception:
-            pass
-
-        # If it can't parse entire string, extract first {...} block
-        start = stripped.find("{")
-        end = stripped.rfind("}")
-        if start == -1 or end == -1 or end <= start:
-            raise ValueError("No JSON object found in LLM output.")
-
-        candidate = stripped[start : end + 1]
+        depth = 0
+        start = -1
+        in_str = False
+        escaped = -1  # index of the character escaped by a preceding backslash
+
+        for m in _JSON_TOKEN.finditer(text):
+            i = m.start()
+            c = text[i]
+            if depth == 0:
+                if c == "{":
+                    start = i
+                    depth = 1
+                continue
 
-        # Final validation
-        try:
-            json.loads(candidate)
-            return candidate
-        except Exception as e:
-            raise ValueError(f"Extracted JSON is invalid: {e}")
+            if in_str:
+                if i == escaped:
+                    continue
+                if c == "\\":
+                    escaped = i + 1
+                elif c == '"':
+                    in_str = False
+            elif c == '"':
+                in_str = True
+            elif c == "{":
+                depth += 1
+            elif c == "}":
+                depth -= 1
+                if depth == 0:
+                    return text[start : i + 1]
+
+        raise ValueError("No JSON object found in LLM output.")